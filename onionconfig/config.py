@@ -66,11 +66,34 @@ class Config(object):
         self.directory = dir_
 
 
+_FROZENSET_POOL = {}
+
+
+def _intern_value(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+def _intern_valueset(values):
+    '''
+    Return a shared frozenset of interned values, so identical filter values
+    across layers and expansions are stored only once
+    '''
+    values = frozenset(_intern_value(value) for value in values)
+    return _FROZENSET_POOL.setdefault(values, values)
+
+
 class Layer(object):
     '''
     Stores a set of settings for a filtering
+
+    Filters are kept in compact form: a tuple of filters, each a tuple of
+    (dimension name, frozenset of values) pairs
     '''
 
+    __slots__ = ("priority", "filters", "name", "data", "lmod", "_dbg_fname")
+
     def __init__(self, fname):
         data = eval(open(fname, "rb").read(), config.context)
         assert isinstance(data, dict)
@@ -78,7 +101,7 @@ class Layer(object):
         self.priority = data.pop("__priority", None) or max(sum([config.dimensions[dim].priority_class
                                                                  for dim in list(filter_.keys())
                                                                  ]) for filter_ in filters)
-        self.filters = Layer._expand_filters(filters)
+        self.filters = Layer._compact_filters(Layer._expand_filters(filters))
         self.name = data.pop("__name", None) or os.path.splitext(os.path.basename(fname))[0]
         self.data = data
         self.lmod = None
@@ -120,13 +143,20 @@ class Layer(object):
                             normalize(expansion.target_dimension_name, target_value)
                             for target_value in expansion.expand(value)
                         ])
-                    new_filter = deepcopy(filter_)
+                    new_filter = dict(filter_)
                     del new_filter[expansion.source_dimension_name]
                     new_filter[expansion.target_dimension_name] = set(target_values)
                     new_filters.append(new_filter)
             filters.extend(new_filters)
         return filters
 
+    @staticmethod
+    def _compact_filters(filters):
+        return tuple(
+            tuple((sys.intern(dim), _intern_valueset(values)) for dim, values in list(filter_.items()))
+            for filter_ in filters
+        )
+
     @staticmethod
     def _preprocess_filters(filters):
         filters = Layer._normalize_filters(filters)
@@ -139,7 +169,7 @@ class Layer(object):
         '''
         for layer_filter in self.filters:
             res = True
-            for key, value in list(layer_filter.items()):
+            for key, value in layer_filter:
                 if filter_.get(key) and filter_[key] not in value:
                     res = False
                     break
@@ -158,24 +188,21 @@ def _get_config_root():
 INVALID_CONFIG_FILES = []
 
 
-@memoize
-def get_layers(directory=None):
+def load_layers(path, invalid_files=None):
     '''
-    Load all the configuration files
+    Load the configuration files matching a glob, sorted by priority
+
+    Files failing to load are appended to invalid_files, defaulting to INVALID_CONFIG_FILES
     '''
-    # can't yield, cause currently used memoize is not generator friendly
+    if invalid_files is None:
+        invalid_files = INVALID_CONFIG_FILES
     res = []
-    if directory:
-        path = os.path.join(_get_config_root(), directory, "*.cfg")
-    else:
-        path = os.path.join(_get_config_root(), "*.cfg")
-
-    for fname in glob.glob(path):
+    # sorted, so layers of equal priority are blended in a stable order
+    for fname in sorted(glob.glob(path)):
         try:
             res.append(Layer(fname))
         except Exception:
-            global INVALID_CONFIG_FILES
-            INVALID_CONFIG_FILES.append(fname)
+            invalid_files.append(fname)
             traceback.print_exc()
             logger.error("Invalid configuration layer in file: {}".format(fname), exc_info=True)
 
@@ -183,14 +210,28 @@ def get_layers(directory=None):
     return res
 
 
+@memoize
+def get_layers(directory=None):
+    '''
+    Load all the configuration files
+    '''
+    # can't yield, cause currently used memoize is not generator friendly
+    if directory:
+        path = os.path.join(_get_config_root(), directory, "*.cfg")
+    else:
+        path = os.path.join(_get_config_root(), "*.cfg")
+    return load_layers(path)
+
+
 def get_applicable_layers(directory, filters):
     return [layer for layer in get_layers(directory) if layer.matches_filter(filters)]
 
 
-@memoize
-def _get_full_config(directory, filters):
+def merge_layers(layers, filters, evaluate=True):
     '''
-    Get all applicable config layers for filter
+    Blend the data of the given layers, ordered by decreasing priority
+
+    Dynamic values are left unevaluated if evaluate is False
     '''
     def unify_config(high, low):
         '''
@@ -210,7 +251,7 @@ def _get_full_config(directory, filters):
             else:
                 value = high_value if high_value is not None else low_value
                 value = deepcopy(value)  # TODO(vhermecz) only needed if contains DynamicValue
-                if isinstance(value, DynamicValue):
+                if evaluate and isinstance(value, DynamicValue):
                     print("Dynvalue in unifyconfig")
                     value = value.evaluate(filters)
             res[key] = value
@@ -222,15 +263,14 @@ def _get_full_config(directory, filters):
             if isinstance(value, ExplicitNone):
                 value = None
                 config[key] = value
-            elif isinstance(value, DynamicValue):
+            elif evaluate and isinstance(value, DynamicValue):
                 print("Dynvalue in finalize_config")
                 value = value.evaluate(filters)
                 config[key] = value
             elif isinstance(value, dict):
                 finalize_config(value)
 
-    real_configs = get_applicable_layers(directory, filters)
-    real_configs = [item.data for item in real_configs]
+    real_configs = [item.data for item in layers]
 
     if len(real_configs) == 0:
         return None
@@ -239,6 +279,14 @@ def _get_full_config(directory, filters):
     return real_config
 
 
+@memoize
+def _get_full_config(directory, filters):
+    '''
+    Get all applicable config layers for filter
+    '''
+    return merge_layers(get_applicable_layers(directory, filters), filters)
+
+
 def _normalize_filter(filters):
     '''
     Remove unicode values, as only str should be used here
@@ -253,7 +301,13 @@ def get_config(path, directory=None, **filters):
     '''
     filters = _normalize_filter(filters)
     config = _get_full_config(directory, filters)
+    return get_path(config, path)
 
+
+def get_path(config, path):
+    '''
+    Get a sub-hierarchy of a resolved configuration by dotted path
+    '''
     if sys.version_info < (3, 0, 0) and isinstance(path, str):
         path = path.encode("UTF-8")
 
@@ -270,6 +324,7 @@ def get_config(path, directory=None, **filters):
 def config_update_receiver(sender, **kwargs):
     _get_full_config.clear()
     get_layers.clear()
+    _FROZENSET_POOL.clear()
     config.update(settings.ONION_CONFIG_SETTINGS)
 
 
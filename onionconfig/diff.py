@@ -0,0 +1,394 @@
+'''
+Impact analysis of layer set changes
+
+Compares two layer directories and tells which filter combinations and
+dotted paths resolve to a different value, to plan reloads and targeted
+cache invalidation.
+
+Rather than resolving every combination of dimension values, the query
+space is split along the filters of the layers touching the changed paths,
+visited by decreasing priority. A branch ends once the changed paths are
+settled by the layers applied so far, and branches reaching the same values
+along the changed paths are resolved only once. A change visible everywhere
+is reported with an empty scope instead of listing every combination.
+'''
+import bisect
+import os
+from collections import namedtuple
+
+from onionconfig.config import _FROZENSET_POOL, _normalize_filter, load_layers, merge_layers
+from onionconfig.special_values import DynamicValue, ExplicitNone
+
+_MISSING = object()
+
+
+def _canonical(value):
+    '''
+    Render a comparable representation of layer data
+
+    Special values compare by identity, so they are represented by their
+    class and attributes, everything else compares by equality
+    '''
+    if isinstance(value, dict):
+        return ("dict", tuple(sorted(((key, _canonical(item)) for key, item in list(value.items())),
+                                     key=lambda item: repr(item[0]))))
+    elif isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(_canonical(item) for item in value))
+    elif isinstance(value, (ExplicitNone, DynamicValue)):
+        return (type(value).__module__, type(value).__name__, _canonical(vars(value)))
+    return value
+
+
+def _layer_signature(layer):
+    filters = frozenset(frozenset(layer_filter) for layer_filter in layer.filters)
+    return (layer.priority, filters, _canonical(layer.data))
+
+
+# Stands for any value not used by the filters of the examined layers
+OTHER_VALUE = "<other>"
+
+_Entry = namedtuple("_Entry", "layer in_old in_new covered")
+
+
+def _covers(data, path):
+    '''
+    Detects if data holds a value for path, or a parent of it, that lower layers can not override
+    '''
+    value = data
+    for key in path.split("."):
+        value = value.get(key)
+        if value is None:
+            return False
+        if not isinstance(value, dict):
+            return True
+    return False
+
+
+def _lookup(config, path, whole):
+    '''
+    Comparable state of path in a resolved config, as far as lower layers are concerned
+    '''
+    value = config
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return ("blocked", _canonical(value))
+        if key not in value:
+            return ("missing",)
+        value = value[key]
+    if isinstance(value, dict) and not whole:
+        return ("dict",)
+    return ("value", _canonical(value))
+
+
+def _overlaps(keys, layer):
+    '''
+    Detects if the layer can take part in resolving paths under the given top level keys
+
+    Settings under a shared key matter even off the paths, as a dict there
+    keeps lower layers from overriding the key with a plain value.
+    '''
+    return any(str(key) in keys for key in layer.data)
+
+
+def _restrict(region, part):
+    res = dict(region)
+    res.update(part)
+    return res
+
+
+def _may_apply(region, filters):
+    return any(all(None in region[dim] or not region[dim].isdisjoint(values) for dim, values in layer_filter)
+               for layer_filter in filters)
+
+
+def _merge_regions(regions):
+    '''
+    Join regions with the same changed paths differing in a single dimension
+    '''
+    merged = True
+    while merged:
+        merged = False
+        for dim in set(dim for region, paths in regions for dim in region):
+            groups = {}
+            for region, paths in regions:
+                key = (tuple(paths), frozenset((key, values) for key, values in list(region.items()) if key != dim))
+                if key in groups:
+                    groups[key][0][dim] = groups[key][0][dim] | region[dim]
+                    merged = True
+                else:
+                    groups[key] = (dict(region), paths)
+            regions = list(groups.values())
+    return regions
+
+
+def _split_region(region, filters):
+    '''
+    Split a region into disjoint parts where the filters apply and where they do not
+
+    A region maps each dimension to the set of its possible values, None
+    standing for the unset dimension, which is matched by any filter.
+    '''
+    applies = []
+    rest = [region]
+    for layer_filter in filters:
+        allowed = [(dim, values | {None}) for dim, values in layer_filter]
+        new_rest = []
+        for part in rest:
+            inside = dict(part)
+            for dim, values in allowed:
+                inside[dim] = part[dim] & values
+            if not all(inside[dim] for dim, values in allowed):
+                new_rest.append(part)
+                continue
+            applies.append(inside)
+            prefix = dict(part)
+            for dim, values in allowed:
+                outside = part[dim] - values
+                if outside:
+                    new_rest.append(_restrict(prefix, {dim: outside}))
+                prefix[dim] = inside[dim]
+        rest = new_rest
+    return applies, rest
+
+
+def flatten_config(config, prefix=""):
+    '''
+    Map dotted paths to leaf values of a resolved config
+    '''
+    res = {}
+    for key, value in list((config or {}).items()):
+        path = prefix + str(key)
+        if isinstance(value, dict) and value:
+            res.update(flatten_config(value, path + "."))
+        else:
+            res[path] = value
+    return res
+
+
+def _changed_paths(old_config, new_config):
+    old_leaves = flatten_config(old_config)
+    new_leaves = flatten_config(new_config)
+    return sorted(path for path in set(old_leaves) | set(new_leaves)
+                  if _canonical(old_leaves.get(path, _MISSING)) != _canonical(new_leaves.get(path, _MISSING)))
+
+
+class LayerSetDiff(object):
+    """
+    Difference between two layer sets
+
+    @ivar added: File names of layers only present in the new set
+    @ivar removed: File names of layers only present in the old set
+    @ivar modified: File names of layers whose priority, filters or data changed
+    @ivar changes: List of (scope, changed dotted paths). A scope maps dimensions to the values
+        it covers, None standing for the unset dimension and OTHER_VALUE for values not used by
+        the examined layers, unlisted dimensions may take any value
+    @ivar invalid_files: Files of either set that failed to load
+    """
+
+    def __init__(self, old_layers, new_layers, invalid_files=()):
+        self.old_layers = old_layers
+        self.new_layers = new_layers
+        self.invalid_files = list(invalid_files)
+        # __name may be shared by several files, the file name is unique within a directory
+        old_by_name = self._old_by_name = dict((os.path.basename(layer._dbg_fname), layer) for layer in old_layers)
+        new_by_name = dict((os.path.basename(layer._dbg_fname), layer) for layer in new_layers)
+        self.added = sorted(set(new_by_name) - set(old_by_name))
+        self.removed = sorted(set(old_by_name) - set(new_by_name))
+        self.modified = sorted(name for name in set(old_by_name) & set(new_by_name)
+                               if _layer_signature(old_by_name[name]) != _layer_signature(new_by_name[name]))
+        self.changed_layers = (
+            [old_by_name[name] for name in self.removed + self.modified] +
+            [new_by_name[name] for name in self.added + self.modified]
+        )
+        self.changes = self._compute_changes()
+
+    def _get_entries(self):
+        '''
+        Layers touching the changed paths, ordered by decreasing priority
+        '''
+        paths = set()
+        for layer in self.changed_layers:
+            name = os.path.basename(layer._dbg_fname)
+            if name not in self.modified:
+                paths.update(flatten_config(layer.data))
+            elif layer in self.new_layers:
+                old_layer = self._old_by_name[name]
+                if old_layer.priority == layer.priority and old_layer.filters == layer.filters:
+                    paths.update(_changed_paths(old_layer.data, layer.data))
+                else:
+                    paths.update(flatten_config(old_layer.data))
+                    paths.update(flatten_config(layer.data))
+        # a changed dict at a parent decides whether a plain value set there by any layer shows through
+        for path in list(paths):
+            parts = path.split(".")
+            for i in range(1, len(parts)):
+                parent = ".".join(parts[:i])
+                if parent in paths:
+                    continue
+                if any(_covers(layer.data, parent) for layer in self.old_layers + self.new_layers):
+                    paths.add(parent)
+        keys = set(path.split(".")[0] for path in paths)
+
+        changed = set(id(layer) for layer in self.changed_layers)
+        entries = []
+        for layer in self.new_layers + [layer for layer in self.old_layers if id(layer) in changed]:
+            if id(layer) not in changed and not _overlaps(keys, layer):
+                continue
+            in_new = id(layer) not in changed or layer in self.new_layers
+            entries.append(_Entry(layer, id(layer) not in changed or not in_new, in_new,
+                                  frozenset(path for path in paths if _covers(layer.data, path))))
+        # the order load_layers blends layers in
+        entries.sort(key=lambda entry: (-entry.layer.get_priority(), os.path.basename(entry.layer._dbg_fname)))
+        return entries, paths
+
+    def _compute_changes(self):
+        entries, paths = self._get_entries()
+        self._universe = {}
+        for entry in entries:
+            for layer_filter in entry.layer.filters:
+                for dim, values in layer_filter:
+                    self._universe.setdefault(dim, {None, OTHER_VALUE}).update(values)
+        self._universe = dict((dim, frozenset(values)) for dim, values in list(self._universe.items()))
+
+        # dimensions the entries from a position on filter on
+        remaining_dims = [frozenset()] * (len(entries) + 1)
+        for i in reversed(list(range(len(entries)))):
+            remaining_dims[i] = remaining_dims[i + 1] | frozenset(
+                dim for layer_filter in entries[i].layer.filters for dim, values in layer_filter)
+        last_changed = max([i for i, entry in enumerate(entries) if not (entry.in_old and entry.in_new)] or [-1])
+        tracked = sorted(set(".".join(path.split(".")[:i])
+                             for path in paths for i in range(1, len(path.split(".")) + 1)))
+
+        # positions of entries per dimension, by filtered value and for filters not using the dimension
+        by_value = {}
+        unfiltered = {}
+        for i, entry in enumerate(entries):
+            for dim in self._universe:
+                for layer_filter in entry.layer.filters:
+                    values = dict(layer_filter).get(dim)
+                    if values is None:
+                        unfiltered.setdefault(dim, []).append(i)
+                    else:
+                        for value in values:
+                            by_value.setdefault(dim, {}).setdefault(value, []).append(i)
+
+        def next_entry(region, i):
+            '''
+            Position of the first entry from i on that may apply within region
+            '''
+            if i == len(entries) or _may_apply(region, entries[i].layer.filters):
+                return i
+            dims = [dim for dim, values in list(region.items()) if None not in values]
+            dim = min(dims, key=lambda dim: len(region[dim]))
+            candidates = [unfiltered.get(dim, [])] + [by_value.get(dim, {}).get(value, []) for value in region[dim]]
+            while i < len(entries):
+                positions = [found[bisect.bisect_left(found, i)] for found in candidates
+                             if bisect.bisect_left(found, i) < len(found)]
+                if not positions:
+                    return len(entries)
+                i = min(positions)
+                if _may_apply(region, entries[i].layer.filters):
+                    return i
+                i += 1
+            return i
+
+        resolved = {}
+
+        def resolve(applied):
+            if applied not in resolved:
+                config = merge_layers([entries[i].layer for i in applied], {}, evaluate=False)
+                covered = set()
+                for i in applied:
+                    covered.update(entries[i].covered)
+                is_settled = covered >= paths and all(_covers(config, path) for path in paths)
+                state = tuple(_lookup(config, path, path in paths) for path in tracked)
+                resolved[applied] = (config, is_settled, state)
+            return resolved[applied]
+
+        memo = {}
+
+        def solve(region, i, old_applied, new_applied):
+            '''
+            Regions within region whose resolution changes, given the entries
+            applied before position i
+            '''
+            i = next_entry(region, i)
+            # the outcome only depends on the tracked values and the dimensions still to split on
+            key = (i, resolve(old_applied)[2], resolve(new_applied)[2],
+                   frozenset((dim, region[dim]) for dim in remaining_dims[i]))
+            if key in memo:
+                return [(_restrict(region, part), changed_paths) for part, changed_paths in memo[key]]
+            dims = remaining_dims[i]
+            regions = []
+            while True:
+                i = next_entry(region, i)
+                old_config, old_settled, old_state = resolve(old_applied)
+                new_config, new_settled, new_state = resolve(new_applied)
+                if i > last_changed and old_state == new_state:
+                    break
+                if i == len(entries) or (old_settled and new_settled):
+                    if old_state != new_state:
+                        changed_paths = _changed_paths(old_config, new_config)
+                        if changed_paths:
+                            regions.append((region, changed_paths))
+                    break
+                entry = entries[i]
+                applies, rest = _split_region(region, entry.layer.filters)
+                for part in applies:
+                    regions.extend(solve(part, i + 1,
+                                         old_applied + (i,) if entry.in_old else old_applied,
+                                         new_applied + (i,) if entry.in_new else new_applied))
+                if not rest:
+                    break
+                for part in rest[1:]:
+                    regions.extend(solve(part, i + 1, old_applied, new_applied))
+                # the remaining part goes on in this frame to keep the recursion shallow
+                region = rest[0]
+                i += 1
+            memo[key] = [(dict((dim, part[dim]) for dim in dims), changed_paths) for part, changed_paths in regions]
+            return regions
+
+        regions = solve(dict(self._universe), 0, (), ())
+        self._regions = _merge_regions(regions)
+        return [(self._get_scope(region), changed_paths) for region, changed_paths in self._regions]
+
+    def _get_scope(self, region):
+        return dict((dim, sorted(values, key=lambda value: (value is not None, str(value))))
+                    for dim, values in list(region.items()) if values != self._universe[dim])
+
+    def affects(self, filters):
+        """
+        Detects if a config retrieved for the filter differs between the sets
+        """
+        filters = _normalize_filter(filters)
+        point = {}
+        for dim, values in list(self._universe.items()):
+            value = filters.get(dim) or None
+            point[dim] = value if value is None or value in values else OTHER_VALUE
+        return any(all(point[dim] in values for dim, values in list(region.items()))
+                   for region, changed_paths in self._regions)
+
+    def get_changed_paths(self):
+        """
+        Dotted paths changing value for at least one combination
+        """
+        return sorted(set(path for filters, paths in self.changes for path in paths))
+
+    def has_changes(self):
+        return bool(self.changed_layers)
+
+
+def diff_layer_directories(old_directory, new_directory):
+    '''
+    Compare the layers of two config directories
+    '''
+    invalid_files = []
+    # keep the value sets of the diffed directories out of the shared pool
+    pool = dict(_FROZENSET_POOL)
+    try:
+        old_layers = load_layers(os.path.join(old_directory, "*.cfg"), invalid_files)
+        new_layers = load_layers(os.path.join(new_directory, "*.cfg"), invalid_files)
+    finally:
+        _FROZENSET_POOL.clear()
+        _FROZENSET_POOL.update(pool)
+    return LayerSetDiff(old_layers, new_layers, invalid_files)
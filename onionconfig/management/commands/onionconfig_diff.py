@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from onionconfig.diff import diff_layer_directories
+
+
+class Command(BaseCommand):
+    help = "Report the filter combinations and paths changed between two layer directories"
+
+    def add_arguments(self, parser):
+        parser.add_argument("old_directory")
+        parser.add_argument("new_directory")
+
+    def handle(self, *args, **options):
+        diff = diff_layer_directories(options["old_directory"], options["new_directory"])
+
+        if diff.invalid_files:
+            for fname in diff.invalid_files:
+                self.stderr.write("Invalid config file: {}".format(fname))
+            raise CommandError("{} config files failed to load".format(len(diff.invalid_files)))
+
+        for label, names in (("Added", diff.added), ("Removed", diff.removed), ("Modified", diff.modified)):
+            for name in names:
+                self.stdout.write("{} layer: {}".format(label, name))
+
+        for scope, paths in diff.changes:
+            scope_repr = ", ".join(
+                "{}={}".format(dim, "|".join("(unset)" if value is None else str(value) for value in values))
+                for dim, values in sorted(scope.items())
+            ) or "*"
+            self.stdout.write("[{}] {}".format(scope_repr, ", ".join(paths)))
+
+        self.stdout.write("{} scopes, {} paths changed".format(len(diff.changes), len(diff.get_changed_paths())))
@@ -0,0 +1,232 @@
+'''
+Bulk config retrieval over columns of dimension values
+
+Resolves a dotted path for every row of a table holding dimension values
+(e.g. a pandas DataFrame with banner/retailer columns). Dimension values are
+encoded as integer codes, and layer applicability is evaluated as a boolean
+matrix over the distinct code combinations, so the layers are only merged
+once per distinct set of applicable layers instead of once per row.
+
+Requires NumPy, pandas is used when available.
+'''
+import numpy as np
+from onionconfig.config import _normalize_filter, config, get_layers, get_path, merge_layers
+from onionconfig.special_values import DynamicValue
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+# Upper bound on the number of cells of an applicability matrix built at once
+MATRIX_SIZE = 2 ** 24
+
+
+def _is_missing(value):
+    # NaN is the only value not equal to itself
+    return value is None or value != value or str(value) == ""
+
+
+def _normalize_value(value):
+    # integer columns with missing values are upcast to float by pandas
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        value = int(value)
+    return str(value)
+
+
+def _factorize(column):
+    '''
+    Encode a column as integer codes into its normalized unique values
+
+    Missing values are encoded as -1
+    '''
+    if pandas is not None:
+        if not hasattr(column, "dtype"):
+            column = np.asarray(column, dtype=object)
+        codes, uniques = pandas.factorize(column)
+        uniques = list(uniques)
+    else:
+        array = np.asarray(column)
+        if array.dtype.kind == "O":
+            index = {}
+            codes = np.fromiter((index.setdefault(value, len(index)) for value in array),
+                                dtype=np.intp, count=len(array))
+            uniques = list(index)
+        else:
+            uniques, codes = np.unique(array, return_inverse=True)
+            uniques = uniques.tolist()
+    codes = np.asarray(codes, dtype=np.intp).reshape(-1)
+
+    values = []
+    remap = np.empty(len(uniques) + 1, dtype=np.intp)
+    remap[-1] = -1
+    for i, value in enumerate(uniques):
+        if _is_missing(value):
+            remap[i] = -1
+        else:
+            remap[i] = len(values)
+            values.append(_normalize_value(value))
+    return remap[codes], values
+
+
+def _has_dynamic_value(value):
+    if isinstance(value, DynamicValue):
+        return True
+    if isinstance(value, dict):
+        return any(_has_dynamic_value(item) for item in list(value.values()))
+    if isinstance(value, (list, tuple)):
+        return any(_has_dynamic_value(item) for item in value)
+    return False
+
+
+def _get_filter_tables(layers, dimensions, values):
+    '''
+    Per layer, per filter, the boolean lookup tables of the codes each filtered dimension accepts
+    '''
+    dim_index = dict((dim, i) for i, dim in enumerate(dimensions))
+    value_index = [dict((value, code) for code, value in enumerate(dim_values)) for dim_values in values]
+    res = []
+    for layer in layers:
+        layer_tables = []
+        for layer_filter in layer.filters:
+            filter_tables = []
+            for dim, layer_values in layer_filter:
+                if dim not in dim_index:
+                    continue
+                j = dim_index[dim]
+                # missing values are coded -1, picking the trailing True
+                table = np.zeros(len(values[j]) + 1, dtype=bool)
+                table[[value_index[j][value] for value in layer_values if value in value_index[j]]] = True
+                table[-1] = True
+                filter_tables.append((j, table))
+            layer_tables.append(filter_tables)
+        res.append(layer_tables)
+    return res
+
+
+def _apply_filter_tables(tables, combinations):
+    res = np.zeros((len(tables), len(combinations)), dtype=bool)
+    for i, layer_tables in enumerate(tables):
+        for filter_tables in layer_tables:
+            if not filter_tables:
+                res[i] = True
+                break
+            mask = filter_tables[0][1][combinations[:, filter_tables[0][0]]]
+            for j, table in filter_tables[1:]:
+                mask &= table[combinations[:, j]]
+            res[i] |= mask
+    return res
+
+
+def get_applicability_matrix(layers, dimensions, values, combinations):
+    '''
+    Boolean matrix telling which layer (row) applies to which combination (column)
+
+    @param dimensions: Dimension names, one per column of combinations
+    @param values: Normalized values of each dimension, indexed by code
+    @param combinations: Integer array of codes, one row per combination, -1 for missing
+    '''
+    return _apply_filter_tables(_get_filter_tables(layers, dimensions, values), combinations)
+
+
+def get_config_column(path, data, directory=None):
+    '''
+    Get a config value for each row of data
+
+    @param data: DataFrame or mapping of dimension names to columns of equal length
+    @return: pandas Series sharing the index of data if it is a DataFrame, otherwise numpy object array
+    '''
+    present = [dim for dim in config.dimensions if dim in data]
+    if hasattr(data, "index"):
+        n_rows = len(data.index)
+    elif present:
+        n_rows = len(data[present[0]])
+    else:
+        n_rows = len(next(iter(data.values()), ()))
+
+    layers = get_layers(directory)
+    dynamic = np.array([_has_dynamic_value(layer.data) for layer in layers], dtype=bool)
+    # dimensions no layer filters on can't change the outcome, unless dynamic values read them
+    if dynamic.any():
+        dimensions = present
+    else:
+        filtered = set(dim for layer in layers for layer_filter in layer.filters for dim, values in layer_filter)
+        dimensions = [dim for dim in present if dim in filtered]
+
+    values = []
+    codes = np.empty((n_rows, len(dimensions)), dtype=np.intp)
+    for j, dim in enumerate(dimensions):
+        codes[:, j], dim_values = _factorize(data[dim])
+        values.append(dim_values)
+
+    if dimensions:
+        sizes = [len(dim_values) + 1 for dim_values in values]
+        if np.prod(sizes, dtype=float) < 2 ** 62:
+            # unique over a flat index is much faster than over rows
+            flat = np.ravel_multi_index(tuple((codes + 1).T), sizes)
+            flat, inverse = np.unique(flat, return_inverse=True)
+            combinations = np.stack(np.unravel_index(flat, sizes), axis=1) - 1
+        else:
+            combinations, inverse = np.unique(codes, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+    else:
+        combinations = np.zeros((1, 0), dtype=np.intp)
+        inverse = np.zeros(n_rows, dtype=np.intp)
+
+    def get_filters(k):
+        return _normalize_filter(dict(
+            (dim, values[j][code]) for j, (dim, code) in enumerate(zip(dimensions, combinations[k])) if code >= 0
+        ))
+
+    # combinations with the same applicable layers resolve the same, unless they hold dynamic values
+    layer_set_index = {}
+    layer_sets = []
+    layer_set_values = []
+    layer_set_ids = np.empty(len(combinations), dtype=np.intp)
+
+    def get_layer_set_id(row):
+        key = row.tobytes()
+        if key not in layer_set_index:
+            layer_set_index[key] = len(layer_sets)
+            applicable = np.flatnonzero(np.unpackbits(row, count=len(layers)))
+            layer_sets.append(applicable)
+            if dynamic[applicable].any():
+                layer_set_values.append(None)
+            else:
+                layer_set_values.append(get_path(merge_layers([layers[i] for i in applicable], {}), path))
+        return layer_set_index[key]
+
+    tables = _get_filter_tables(layers, dimensions, values)
+    n_words = -(-len(layers) // 64)
+    weights = np.random.RandomState(0).randint(1, 2 ** 63, size=n_words, dtype=np.uint64) | 1
+    # bound the size of the applicability matrix
+    chunk_size = max(1, MATRIX_SIZE // max(1, len(layers)))
+    for start in range(0, len(combinations), chunk_size):
+        matrix = _apply_filter_tables(tables, combinations[start:start + chunk_size])
+        # packing along contiguous rows is much faster than along columns
+        packed = np.packbits(np.ascontiguousarray(matrix.T), axis=1)
+        # group identical columns by a hash of their packed bits, checking the groups exactly
+        words = np.zeros((len(packed), n_words * 8), dtype=np.uint8)
+        words[:, :packed.shape[1]] = packed
+        words = words.view(np.uint64)
+        first, group = np.unique((words * weights).sum(axis=1), return_index=True, return_inverse=True)[1:]
+        group = group.reshape(-1)
+        collided = np.flatnonzero((words != words[first[group]]).any(axis=1))
+        group_ids = np.array([get_layer_set_id(packed[k]) for k in first], dtype=np.intp)
+        layer_set_ids[start:start + len(packed)] = group_ids[group]
+        for k in collided:
+            layer_set_ids[start + k] = get_layer_set_id(packed[k])
+
+    resolved = np.empty(len(layer_set_values), dtype=object)
+    for i, value in enumerate(layer_set_values):
+        resolved[i] = value
+    resolved = resolved[layer_set_ids]
+    is_dynamic = np.array([dynamic[applicable].any() for applicable in layer_sets], dtype=bool)
+    for k in np.flatnonzero(is_dynamic[layer_set_ids]):
+        # dynamic values are evaluated with the filter of each combination
+        resolved[k] = get_path(merge_layers([layers[i] for i in layer_sets[layer_set_ids[k]]], get_filters(k)), path)
+
+    res = resolved[inverse]
+    if hasattr(data, "index") and pandas is not None:
+        return pandas.Series(res, index=data.index, name=path)
+    return res
@@ -13,5 +13,8 @@ setup(
     version=version,
     install_requires=[
         'Django>=1.8',
-    ]
+    ],
+    extras_require={
+        'vectorized': ['numpy', 'pandas'],
+    }
 )